@@ -1,9 +1,12 @@
-from pandas import DataFrame
+from typing import TYPE_CHECKING
 
 from pyinsurance.data.utility import load_file
 
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
-def load() -> DataFrame:
+
+def load() -> "DataFrame":
 
     """
     Load the irx data used in the examples
@@ -1,9 +1,10 @@
 import os
+from typing import TYPE_CHECKING
 
-import pandas as pd
-from pandas import DataFrame
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
-def load_file(file_base: str, filename: str) -> DataFrame:
+def load_file(file_base: str, filename: str) -> "DataFrame":
     """
     Load data from a csv.gz file.
     Parameters
@@ -17,6 +18,8 @@ def load_file(file_base: str, filename: str) -> DataFrame:
     DataFrame
         Dataframe containing the loaded data.
     """
+    import pandas as pd  # imported lazily, pandas is slow to import
+
     curr_dir = os.path.split(os.path.abspath(file_base))[0]
     data = pd.read_csv(os.path.join(curr_dir, filename))
     if "Date" in data:
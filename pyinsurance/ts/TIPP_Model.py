@@ -1,10 +1,276 @@
+import logging
+import math
+
 import numpy as np
-import numba as nb
+
+try :
+    import numba as nb
+    _void , _f8 , _intp = nb.void , nb.float64 , nb.intp
+    _in_vec = nb.types.Array(nb.float64, 1, 'C', readonly = True)   #inputs may come read-only from pandas
+    _in_mtx = nb.types.Array(nb.float64, 2, 'C', readonly = True)
+    _in_flags = nb.types.Array(nb.boolean, 1, 'C', readonly = True)
+    _out_vec , _out_mtx , _out_tensor = nb.float64[::1] , nb.float64[:, ::1] , nb.float64[:, :, ::1]
+    _out_steps , _out_steps_mtx = nb.intp[::1] , nb.intp[:, ::1]
+    _prange = nb.prange
+except ImportError :
+    nb = None
+    _void = _f8 = _intp = _in_vec = _in_mtx = _in_flags = None
+    _out_vec = _out_mtx = _out_tensor = _out_steps = _out_steps_mtx = None
+    _prange = range
+
+OPEN_DAYS_PER_YEAR = 252
+
+_logger = logging.getLogger(__name__)
+
+#Columns of the state matrix : the series of a step share one cache line. Capital
+#reinjections are rare, so they are recorded as (step, amount) events instead.
+_FUND , _REFERENCE , _FLOOR = 0 , 1 , 2
+
+
+def _njit(restype, *argtypes, parallel = False) :
+
+    """
+    Eagerly compile a kernel in nopython mode for the given signature, or
+    leave it as plain Python when numba is not installed. The machine code
+    is cached next to the module, so only the first import pays for it.
+    """
+
+    if nb is None :
+        return lambda kernel : kernel
+    return nb.njit(restype(*argtypes), cache = True, fastmath = True, boundscheck = False, parallel = parallel)
+
+
+@_njit(_intp, _in_vec, _in_vec, _in_vec, _out_mtx, _out_steps, _out_vec, _f8, _f8, _f8, _f8, _f8, _f8, _f8)
+def _tipp_kernel(risk_return_mtx, safe_asset, log_growth, state, injection_steps, injection_amounts, Lock_in \
+                 , floor_percent, Goal, multiplier, Min_risk_part, period, Capital_reinjection_rate) :
+
+    """
+    Sequential TIPP recurrence, filling the (N, 3) state matrix in place.
+    Capital reinjections are written to injection_steps / injection_amounts
+    and their number is returned.
+
+    log_growth holds log1p(safe_asset * Rebalancement_frequency), so the floor
+    discount is exp(log_growth * Goal) ; Goal shrinks by period = 1 /
+    Rebalancement_frequency at each step.
+    """
+
+    discount = math.exp(log_growth[0] * Goal)
+    injections = 0
+
+    for i in range(1, state.shape[0]) :
+
+        fund , reference , floor = state[i-1, _FUND] , state[i-1, _REFERENCE] , state[i-1, _FLOOR]
+
+        #The floor ratchets on the fund value before any capital reinjection.
+        floor_cap_update  = fund * floor_percent/discount
+
+        if floor_cap_update > floor :
+            state[i, _FLOOR] = floor_cap_update
+        else :
+            state[i, _FLOOR] = floor
+
+        #A reinjection can only happen below the reference capital, so it excludes a lock-in.
+        diff = reference * Capital_reinjection_rate - fund
+        if diff > 0 :
+            fund = fund + diff
+            state[i-1, _FUND] = fund
+            state[i, _REFERENCE] = reference - diff
+            injection_steps[injections] = i
+            injection_amounts[injections] = diff
+            injections += 1
+        elif fund >= (1+Lock_in)*reference :
+            state[i, _REFERENCE] = fund
+        else :
+            state[i, _REFERENCE] = reference
+
+        #Clamp of the cushion exposure, written as compares the compiler turns into minsd / maxsd.
+        risk_asset = multiplier * (fund - floor)
+        if risk_asset > fund :
+            risk_asset = fund
+        if risk_asset < Min_risk_part * fund :
+            risk_asset = Min_risk_part * fund
+        riskless_asset = fund - risk_asset
+        state[i, _FUND] = fund + risk_asset * risk_return_mtx[i] + riskless_asset * safe_asset[i]
+        Goal = Goal - period
+        discount = math.exp(log_growth[i] * Goal)
+
+    return injections
+
+
+@_njit(_intp, _in_vec, _f8, _f8, _out_mtx, _out_steps, _out_vec, _f8, _f8, _f8, _f8, _f8, _f8, _f8)
+def _tipp_kernel_constant_rate(risk_return_mtx, safe_rate, log_growth, state, injection_steps, injection_amounts \
+                               , Lock_in, floor_percent, Goal, multiplier, Min_risk_part, period, Capital_reinjection_rate) :
+
+    """
+    _tipp_kernel specialised for a constant safe rate : the growth factor
+    and the discount step are hoisted out of the loop, and the discount is
+    updated with a single multiplication per step.
+    """
+
+    one_plus_rate = 1 + safe_rate
+    discount_step = math.exp(-log_growth * period)
+    discount = math.exp(log_growth * Goal)
+    injections = 0
+
+    for i in range(1, state.shape[0]) :
+
+        fund , reference , floor = state[i-1, _FUND] , state[i-1, _REFERENCE] , state[i-1, _FLOOR]
+
+        floor_cap_update  = fund * floor_percent/discount
+
+        if floor_cap_update > floor :
+            state[i, _FLOOR] = floor_cap_update
+        else :
+            state[i, _FLOOR] = floor
+
+        diff = reference * Capital_reinjection_rate - fund
+        if diff > 0 :
+            fund = fund + diff
+            state[i-1, _FUND] = fund
+            state[i, _REFERENCE] = reference - diff
+            injection_steps[injections] = i
+            injection_amounts[injections] = diff
+            injections += 1
+        elif fund >= (1+Lock_in)*reference :
+            state[i, _REFERENCE] = fund
+        else :
+            state[i, _REFERENCE] = reference
+
+        risk_asset = multiplier * (fund - floor)
+        if risk_asset > fund :
+            risk_asset = fund
+        if risk_asset < Min_risk_part * fund :
+            risk_asset = Min_risk_part * fund
+        #Whole fund grows at the safe rate, plus the excess return of the risky part.
+        state[i, _FUND] = fund * one_plus_rate + risk_asset * (risk_return_mtx[i] - safe_rate)
+        discount = discount * discount_step
+
+    return injections
+
+
+@_njit(_void, _in_mtx, _in_mtx, _in_mtx, _out_tensor, _out_steps_mtx, _out_mtx, _out_steps, _f8, _f8, _f8, _f8, _f8, _f8, _f8 \
+       , _in_flags, parallel = True)
+def _tipp_batch_kernel(risk_return_mtx, safe_asset, log_growth, state, injection_steps, injection_amounts, injection_count \
+                       , Lock_in, floor_percent, Goal, multiplier, Min_risk_part, period, Capital_reinjection_rate, constant_rate) :
+
+    """
+    Run the TIPP recurrence of each scenario (first axis) in parallel.
+    """
+
+    for s in _prange(state.shape[0]) :
+        if constant_rate[s] :
+            injection_count[s] = _tipp_kernel_constant_rate(risk_return_mtx[s], safe_asset[s, 0], log_growth[s, 0], state[s] \
+                                                            , injection_steps[s], injection_amounts[s], Lock_in, floor_percent \
+                                                            , Goal, multiplier, Min_risk_part, period, Capital_reinjection_rate)
+        else :
+            injection_count[s] = _tipp_kernel(risk_return_mtx[s], safe_asset[s], log_growth[s], state[s], injection_steps[s] \
+                                              , injection_amounts[s], Lock_in, floor_percent, Goal, multiplier \
+                                              , Min_risk_part, period, Capital_reinjection_rate)
+
+
+def _tipp_loop(risk_return_mtx, safe_asset, log_growth, state, injection_steps, injection_amounts, Lock_in \
+               , floor_percent, Goal, multiplier, Min_risk_part, period, Capital_reinjection_rate) :
+
+    """
+    Pure Python version of _tipp_kernel, used when neither numba nor the
+    compiled extension is available. Inputs and outputs go through lists so
+    the loop works on Python floats instead of NumPy scalars.
+    """
+
+    risk_returns , safe_rates , growth = risk_return_mtx.tolist() , safe_asset.tolist() , log_growth.tolist()
+    size , exp = state.shape[0] , math.exp
+    funds , references , floors = [0.0] * size , [0.0] * size , [0.0] * size
+    steps , amounts = [] , []
+    fund , reference , floor = float(state[0, _FUND]) , float(state[0, _REFERENCE]) , float(state[0, _FLOOR])
+    funds[0] , references[0] , floors[0] = fund , reference , floor
+    lock_in_level = 1 + Lock_in
+    discount = exp(growth[0] * Goal)
+
+    for i in range(1, size) :
+
+        floor_cap_update  = fund * floor_percent/discount
+        next_floor = floor_cap_update if floor_cap_update > floor else floor
+
+        diff = reference * Capital_reinjection_rate - fund
+        if diff > 0 :
+            fund = fund + diff
+            funds[i-1] = fund
+            reference = reference - diff
+            steps.append(i)
+            amounts.append(diff)
+        elif fund >= lock_in_level * reference :
+            reference = fund
+
+        risk_asset = multiplier * (fund - floor)
+        if risk_asset > fund :
+            risk_asset = fund
+        if risk_asset < Min_risk_part * fund :
+            risk_asset = Min_risk_part * fund
+        fund = fund + risk_asset * risk_returns[i] + (fund - risk_asset) * safe_rates[i]
+        floor = next_floor
+
+        funds[i] , references[i] , floors[i] = fund , reference , floor
+        Goal = Goal - period
+        discount = exp(growth[i] * Goal)
+
+    state[:, _FUND] , state[:, _REFERENCE] , state[:, _FLOOR] = funds , references , floors
+    injection_steps[:len(steps)] , injection_amounts[:len(amounts)] = steps , amounts
+    return len(steps)
+
+
+def _tipp_loop_constant_rate(risk_return_mtx, safe_rate, log_growth, state, injection_steps, injection_amounts \
+                             , Lock_in, floor_percent, Goal, multiplier, Min_risk_part, period, Capital_reinjection_rate) :
+
+    """
+    Pure Python counterpart of _tipp_kernel_constant_rate.
+    """
+
+    return _tipp_loop(risk_return_mtx, np.full(risk_return_mtx.size, safe_rate), np.full(risk_return_mtx.size, log_growth) \
+                      , state, injection_steps, injection_amounts, Lock_in, floor_percent, Goal, multiplier \
+                      , Min_risk_part, period, Capital_reinjection_rate)
+
+
+def _tipp_batch_loop(risk_return_mtx, safe_asset, log_growth, state, injection_steps, injection_amounts, injection_count \
+                     , Lock_in, floor_percent, Goal, multiplier, Min_risk_part, period, Capital_reinjection_rate, constant_rate) :
+
+    """
+    Sequential counterpart of _tipp_batch_kernel, used without numba.
+    """
+
+    for s in range(state.shape[0]) :
+        if constant_rate[s] :
+            injection_count[s] = _run_kernel_constant_rate(risk_return_mtx[s], float(safe_asset[s, 0]), float(log_growth[s, 0]) \
+                                                           , state[s], injection_steps[s], injection_amounts[s], Lock_in \
+                                                           , floor_percent, Goal, multiplier, Min_risk_part, period \
+                                                           , Capital_reinjection_rate)
+        else :
+            injection_count[s] = _run_kernel(risk_return_mtx[s], safe_asset[s], log_growth[s], state[s], injection_steps[s] \
+                                             , injection_amounts[s], Lock_in, floor_percent, Goal, multiplier \
+                                             , Min_risk_part, period, Capital_reinjection_rate)
+
+
+try :
+    from pyinsurance.ts._tipp import tipp_kernel as _run_kernel , \
+                                     tipp_kernel_constant_rate as _run_kernel_constant_rate
+except ImportError :
+    if nb is None :
+        _run_kernel , _run_kernel_constant_rate = _tipp_loop , _tipp_loop_constant_rate
+    else :
+        _run_kernel , _run_kernel_constant_rate = _tipp_kernel , _tipp_kernel_constant_rate
+
+_run_batch_kernel = _tipp_batch_loop if nb is None else _tipp_batch_kernel
+
+#Kernels are plain functions, without compile stats, under NUMBA_DISABLE_JIT.
+if nb is not None and any(getattr(kernel, 'stats', None) is not None and kernel.stats.cache_misses \
+                          for kernel in (_tipp_kernel, _tipp_kernel_constant_rate, _tipp_batch_kernel)) :
+    _logger.info('The TIPP kernels were compiled by numba, a one-time cost : later imports load them from the cache')
+
+
 class TIPP :
     
     def __init__(self,risk_returns,safe_asset,Lock_in,\
                  Min_risk_part,Capital_reinjection_rate,Initial_funds\
-                ,floor_percent,multiplier,Rebalancement_frequency = 252):
+                ,floor_percent,multiplier,Rebalancement_frequency = OPEN_DAYS_PER_YEAR):
 
             self.risk_returns = risk_returns
             self.Rebalancement_frequency = Rebalancement_frequency
@@ -19,21 +285,22 @@ class TIPP :
                                   ,Capital_reinjection_rate,Initial_funds \
                                   ,floor_percent,multiplier,Rebalancement_frequency)
 
-    def initiate_funds(self,risk_returns_mtx,safe_asset_mtx,Initial_funds,Rebalancement_frequency,floor_percent) :
+    @staticmethod
+    def initiate_funds(risk_returns_mtx,safe_asset_mtx,Initial_funds,Rebalancement_frequency,floor_percent) :
 
-        Goal = risk_returns_mtx.size / Rebalancement_frequency   #This initiate the goal of xxx days of investment to today.
-        Actualizer = (1+safe_asset_mtx[0] * Rebalancement_frequency / 252)**Goal
+        Goal = risk_returns_mtx.shape[-1] / Rebalancement_frequency   #This initiate the goal of xxx days of investment to today.
+        Actualizer = np.exp(np.log1p(safe_asset_mtx[..., 0] * Rebalancement_frequency / OPEN_DAYS_PER_YEAR) * Goal)
         floor_cap = Initial_funds * floor_percent / Actualizer
         return floor_cap,Goal
 
 
-    def Matrix_Preparation(self,risk_return_mtx,safe_asset_mtx,floor_cap,Initial_funds):
-        mtx= np.ones(risk_return_mtx.size)
-        floor_matrix = mtx * floor_cap
-        Reference_cap_matrix , Fund_matrix  = mtx * Initial_funds , mtx *  Initial_funds
-        Capital_reijection_matrix  =np.zeros( len(risk_return_mtx) )
-        return floor_matrix , Reference_cap_matrix , Capital_reijection_matrix \
-               , Fund_matrix
+    @staticmethod
+    def Matrix_Preparation(risk_return_mtx,safe_asset_mtx,floor_cap,Initial_funds):
+        #Only the first row is read before the kernel writes the rest, so the tail is left uninitialised.
+        state = np.empty(risk_return_mtx.shape + (3,), dtype = np.float64, order = 'C')
+        state[..., 0, _FUND] = state[..., 0, _REFERENCE] = Initial_funds
+        state[..., 0, _FLOOR] = floor_cap
+        return state
 
 
     def tipp(self,risk_returns,safe_asset,Lock_in,Min_risk_part \
@@ -43,18 +310,17 @@ class TIPP :
         if len(risk_returns) < 2 and len(safe_asset) < 2  : 
             raise ValueError('More than 2 entries are required for each input')
 
-        risk_return_mtx = risk_returns.values.reshape(-1)
-        safe_asset_mtx = safe_asset.values.reshape(-1)
+        risk_return_mtx = np.ascontiguousarray(risk_returns.values.reshape(-1), dtype = np.float64)
+        safe_asset_mtx = np.ascontiguousarray(safe_asset.values.reshape(-1), dtype = np.float64)
         
         if safe_asset_mtx.size != risk_return_mtx.size : 
             raise ValueError('x and y must be of the same length')
 
         floor_cap,Goal = self.initiate_funds(risk_return_mtx,safe_asset_mtx,Initial_funds,Rebalancement_frequency,floor_percent)
-        floor_matrix , Reference_cap_matrix , Capital_reijection_matrix , Fund_matrix = self.Matrix_Preparation(risk_return_mtx,safe_asset_mtx,floor_cap,Initial_funds)
+        state = self.Matrix_Preparation(risk_return_mtx,safe_asset_mtx,floor_cap,Initial_funds)
 
         try :
-            Fund_matrix , floor_matrix , Capital_reijection_matrix , Reference_cap_matrix,return_mtx = self.TPPI_calculator_MC(risk_return_mtx,floor_matrix , Reference_cap_matrix \
-                                                                                                            ,Capital_reijection_matrix,Fund_matrix ,Lock_in \
+            Fund_matrix , floor_matrix , Capital_reijection_matrix , Reference_cap_matrix,return_mtx = self.TPPI_calculator_MC(risk_return_mtx,state ,Lock_in \
                                                                                                             ,floor_percent,Goal,multiplier,Min_risk_part,safe_asset_mtx\
                                                                                                             ,Rebalancement_frequency,Capital_reinjection_rate)
         except : 
@@ -66,39 +332,88 @@ class TIPP :
 
 
     @staticmethod
-    @nb.njit
-    def TPPI_calculator_MC(risk_return_mtx,floor_matrix , Reference_cap_matrix , Capital_reijection_matrix \
-                          ,Fund_matrix ,Lock_in,floor_percent,Goal,multiplier,Min_risk_part,safe_asset\
+    def TPPI_calculator_MC(risk_return_mtx,state ,Lock_in,floor_percent,Goal,multiplier,Min_risk_part,safe_asset\
                           ,Rebalancement_frequency,Capital_reinjection_rate) :
 
-        for i in range(1,floor_matrix.size) :
-
-            if Fund_matrix[i-1] >= (1+Lock_in)*Reference_cap_matrix[i - 1]:
-                Reference_cap_matrix[i] = Fund_matrix[ i - 1]
-            else :
-                Reference_cap_matrix[i] = Reference_cap_matrix[i - 1]
-                
-            floor_cap_update  = Fund_matrix[i-1] * floor_percent/((1+safe_asset[i-1] * Rebalancement_frequency)**Goal)
-
-            if floor_cap_update > floor_matrix[i-1] : 
-                floor_matrix[i] = floor_cap_update 
-            else : 
-                floor_matrix[i] = floor_matrix[i-1]
-                    
-            if Fund_matrix[i-1] < Reference_cap_matrix[i-1] * Capital_reinjection_rate :
-                diff = Reference_cap_matrix[i-1] * Capital_reinjection_rate - Fund_matrix[i-1]
-                Reference_cap_matrix[i] = Reference_cap_matrix[i-1] - diff
-                Fund_matrix[i - 1]  = Fund_matrix[i - 1] + diff 
-                Capital_reijection_matrix[i] = diff
-            else : 
-                Capital_reijection_matrix[i] = 0
-
-            C = Fund_matrix[i-1] - floor_matrix[i-1]
-            risk_asset = max(min(multiplier * C, Fund_matrix[i-1]),Min_risk_part * Fund_matrix[i-1]) 
-            riskless_asset = Fund_matrix[i-1] - risk_asset
-            Fund_matrix[i] = risk_asset * (1 + risk_return_mtx[i]) + riskless_asset * ( 1 + safe_asset[i])
-            Goal = Goal - 1/Rebalancement_frequency
-        
+        period = 1 / Rebalancement_frequency
+        #Pages of np.empty are only touched when a reinjection is recorded.
+        injection_steps , injection_amounts = np.empty(state.shape[0], dtype = np.intp) , np.empty(state.shape[0])
+
+        if np.ptp(safe_asset) == 0 :
+            safe_rate = float(safe_asset[0])
+            injection_count = _run_kernel_constant_rate(risk_return_mtx, safe_rate, math.log1p(safe_rate * Rebalancement_frequency) \
+                                                        , state, injection_steps, injection_amounts, float(Lock_in) \
+                                                        , float(floor_percent), float(Goal), float(multiplier) \
+                                                        , float(Min_risk_part), float(period), float(Capital_reinjection_rate))
+        else :
+            log_growth = np.log1p(safe_asset * Rebalancement_frequency)
+            injection_count = _run_kernel(risk_return_mtx, safe_asset, log_growth, state, injection_steps, injection_amounts \
+                                          , float(Lock_in), float(floor_percent), float(Goal), float(multiplier) \
+                                          , float(Min_risk_part), float(period), float(Capital_reinjection_rate))
+
+        Fund_matrix , Reference_cap_matrix , floor_matrix = state[:, _FUND] , state[:, _REFERENCE] , state[:, _FLOOR]
+        Capital_reijection_matrix = np.zeros(state.shape[0])
+        Capital_reijection_matrix[injection_steps[:injection_count]] = injection_amounts[:injection_count]
         return_mtx = (Fund_matrix[1:] - Fund_matrix[:-1])/Fund_matrix[:-1]
 
         return  Fund_matrix , floor_matrix , Capital_reijection_matrix , Reference_cap_matrix,return_mtx
+
+
+    @classmethod
+    def tipp_batch(cls,risk_returns,safe_asset,Lock_in,Min_risk_part \
+                   ,Capital_reinjection_rate,Initial_funds ,floor_percent,multiplier\
+                   ,Rebalancement_frequency = OPEN_DAYS_PER_YEAR) :
+
+        """
+        Runs the TIPP strategy over several scenarios in parallel
+
+        Parameters
+        ----------
+        risk_returns : np.ndarray , of shape (scenarios, periods)
+        safe_asset : np.ndarray , of shape (scenarios, periods)
+        Lock_in : np.float64
+        Min_risk_part : np.float64
+        Capital_reinjection_rate : np.float64
+        Initial_funds : np.float64
+        floor_percent : np.float64
+        multiplier : np.float64
+        Rebalancement_frequency : np.float64
+
+        Returns
+        ----------
+
+        Same outputs as TIPP.tipp , each with a leading scenario axis
+        """
+
+        risk_return_mtx = np.ascontiguousarray(risk_returns, dtype = np.float64)
+        safe_asset_mtx = np.ascontiguousarray(safe_asset, dtype = np.float64)
+
+        if risk_return_mtx.ndim != 2 or safe_asset_mtx.shape != risk_return_mtx.shape :
+            raise ValueError('x and y must be 2 dimensional arrays of the same shape')
+
+        if risk_return_mtx.shape[1] < 2 :
+            raise ValueError('More than 2 entries are required for each input')
+
+        floor_cap,Goal = cls.initiate_funds(risk_return_mtx,safe_asset_mtx,Initial_funds,Rebalancement_frequency,floor_percent)
+        state = cls.Matrix_Preparation(risk_return_mtx,safe_asset_mtx,floor_cap,Initial_funds)
+
+        log_growth = np.log1p(safe_asset_mtx * Rebalancement_frequency)
+        constant_rate = np.ptp(safe_asset_mtx, axis = 1) == 0
+
+        injection_steps = np.empty(risk_return_mtx.shape, dtype = np.intp)
+        injection_amounts = np.empty(risk_return_mtx.shape)
+        injection_count = np.empty(risk_return_mtx.shape[0], dtype = np.intp)
+
+        _run_batch_kernel(risk_return_mtx, safe_asset_mtx, log_growth, state, injection_steps, injection_amounts \
+                          , injection_count, float(Lock_in), float(floor_percent), float(Goal), float(multiplier) \
+                          , float(Min_risk_part), float(1 / Rebalancement_frequency), float(Capital_reinjection_rate) \
+                          , constant_rate)
+
+        Fund_matrix , Reference_cap_matrix , floor_matrix = state[..., _FUND] , state[..., _REFERENCE] , state[..., _FLOOR]
+        recorded = np.arange(risk_return_mtx.shape[1]) < injection_count[:, None]
+        Capital_reijection_matrix = np.zeros(risk_return_mtx.shape)
+        Capital_reijection_matrix[np.nonzero(recorded)[0], injection_steps[recorded]] = injection_amounts[recorded]
+        return_mtx = (Fund_matrix[:, 1:] - Fund_matrix[:, :-1])/Fund_matrix[:, :-1]
+
+        return Fund_matrix , floor_matrix , Capital_reijection_matrix ,\
+                Reference_cap_matrix,risk_return_mtx[:, 1:],safe_asset_mtx[:, 1:], return_mtx
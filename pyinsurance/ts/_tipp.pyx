@@ -0,0 +1,119 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True, initializedcheck=False, language_level=3
+
+"""
+Compiled TIPP recurrence. Mirrors _tipp_kernel in TIPP_Model.py, which is
+used whenever this extension has not been built.
+"""
+
+from libc.math cimport exp, fma
+
+#Columns of the state matrix, same layout as TIPP_Model.
+cdef enum :
+    FUND = 0
+    REFERENCE = 1
+    FLOOR = 2
+
+
+def tipp_kernel(const double[::1] risk_return_mtx, const double[::1] safe_asset, const double[::1] log_growth \
+                , double[:, ::1] state, Py_ssize_t[::1] injection_steps, double[::1] injection_amounts \
+                , double Lock_in, double floor_percent, double Goal, double multiplier, double Min_risk_part \
+                , double period, double Capital_reinjection_rate) :
+
+    """
+    Sequential TIPP recurrence, filling the (N, 3) state matrix in place and
+    returning the number of recorded capital reinjections.
+    """
+
+    cdef Py_ssize_t i , injections = 0
+    cdef double fund , reference , floor , floor_cap_update , diff , risk_asset , riskless_asset
+    cdef double discount = exp(log_growth[0] * Goal)
+
+    with nogil :
+        for i in range(1, state.shape[0]) :
+
+            fund , reference , floor = state[i-1, FUND] , state[i-1, REFERENCE] , state[i-1, FLOOR]
+
+            #The floor ratchets on the fund value before any capital reinjection.
+            floor_cap_update = fund * floor_percent / discount
+
+            if floor_cap_update > floor :
+                state[i, FLOOR] = floor_cap_update
+            else :
+                state[i, FLOOR] = floor
+
+            diff = reference * Capital_reinjection_rate - fund
+            if diff > 0 :
+                fund = fund + diff
+                state[i-1, FUND] = fund
+                state[i, REFERENCE] = reference - diff
+                injection_steps[injections] = i
+                injection_amounts[injections] = diff
+                injections += 1
+            elif fund >= (1 + Lock_in) * reference :
+                state[i, REFERENCE] = fund
+            else :
+                state[i, REFERENCE] = reference
+
+            risk_asset = multiplier * (fund - floor)
+            if risk_asset > fund :
+                risk_asset = fund
+            if risk_asset < Min_risk_part * fund :
+                risk_asset = Min_risk_part * fund
+            riskless_asset = fund - risk_asset
+            #Baseline x86-64 builds never contract to FMA on their own, so fuse explicitly.
+            state[i, FUND] = fund + fma(risk_asset, risk_return_mtx[i], riskless_asset * safe_asset[i])
+            Goal = Goal - period
+            discount = exp(log_growth[i] * Goal)
+
+    return injections
+
+
+def tipp_kernel_constant_rate(const double[::1] risk_return_mtx, double safe_rate, double log_growth \
+                              , double[:, ::1] state, Py_ssize_t[::1] injection_steps, double[::1] injection_amounts \
+                              , double Lock_in, double floor_percent, double Goal, double multiplier \
+                              , double Min_risk_part, double period, double Capital_reinjection_rate) :
+
+    """
+    tipp_kernel specialised for a constant safe rate.
+    """
+
+    cdef Py_ssize_t i , injections = 0
+    cdef double fund , reference , floor , floor_cap_update , diff , risk_asset
+    cdef double one_plus_rate = 1 + safe_rate
+    cdef double discount_step = exp(-log_growth * period)
+    cdef double discount = exp(log_growth * Goal)
+
+    with nogil :
+        for i in range(1, state.shape[0]) :
+
+            fund , reference , floor = state[i-1, FUND] , state[i-1, REFERENCE] , state[i-1, FLOOR]
+
+            floor_cap_update = fund * floor_percent / discount
+
+            if floor_cap_update > floor :
+                state[i, FLOOR] = floor_cap_update
+            else :
+                state[i, FLOOR] = floor
+
+            diff = reference * Capital_reinjection_rate - fund
+            if diff > 0 :
+                fund = fund + diff
+                state[i-1, FUND] = fund
+                state[i, REFERENCE] = reference - diff
+                injection_steps[injections] = i
+                injection_amounts[injections] = diff
+                injections += 1
+            elif fund >= (1 + Lock_in) * reference :
+                state[i, REFERENCE] = fund
+            else :
+                state[i, REFERENCE] = reference
+
+            risk_asset = multiplier * (fund - floor)
+            if risk_asset > fund :
+                risk_asset = fund
+            if risk_asset < Min_risk_part * fund :
+                risk_asset = Min_risk_part * fund
+            state[i, FUND] = fma(fund, one_plus_rate, risk_asset * (risk_return_mtx[i] - safe_rate))
+            discount = discount * discount_step
+
+    return injections
@@ -1,3 +1,15 @@
-from setuptools import setup
+from setuptools import Extension, setup
 
-setup()
\ No newline at end of file
+#The compiled TIPP kernel is optional : Cython comes from the build-system
+#requirements of pyproject.toml, and a missing C compiler (or a legacy build
+#without Cython) leaves the package on the numba / pure Python kernel in
+#TIPP_Model.py.
+#numba itself is optional too (pip install pyinsurance[jit]) ; its kernels are
+#compiled on the first import and cached for the following ones.
+try :
+    from Cython.Build import cythonize
+    ext_modules = cythonize([Extension('pyinsurance.ts._tipp', ['pyinsurance/ts/_tipp.pyx'], optional = True)])
+except ImportError :
+    ext_modules = []
+
+setup(ext_modules = ext_modules)
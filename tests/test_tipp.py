@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import pyinsurance.ts.TIPP_Model as TIPP_Model
+from pyinsurance.data.IRX import load as load_irx
+from pyinsurance.data.sp500 import load as load_sp500
+from pyinsurance.ts.TIPP_Model import TIPP
+
+
+def reference_tipp(risk_returns, safe_asset, Lock_in, Min_risk_part, Capital_reinjection_rate, Initial_funds \
+                   , floor_percent, multiplier, Rebalancement_frequency) :
+
+    """
+    Straightforward transcription of the original TIPP recurrence, used as
+    the ground truth for every kernel backend.
+    """
+
+    size = risk_returns.size
+    Goal = size / Rebalancement_frequency
+    floor_cap = Initial_funds * floor_percent / (1 + safe_asset[0] * Rebalancement_frequency / 252) ** Goal
+    fund , reference , floor = np.full(size, float(Initial_funds)) , np.full(size, float(Initial_funds)) , np.full(size, floor_cap)
+    reinjection = np.zeros(size)
+
+    for i in range(1, size) :
+        if fund[i-1] >= (1 + Lock_in) * reference[i-1] :
+            reference[i] = fund[i-1]
+        else :
+            reference[i] = reference[i-1]
+        floor[i] = max(fund[i-1] * floor_percent / (1 + safe_asset[i-1] * Rebalancement_frequency) ** Goal, floor[i-1])
+        if fund[i-1] < reference[i-1] * Capital_reinjection_rate :
+            diff = reference[i-1] * Capital_reinjection_rate - fund[i-1]
+            reference[i] = reference[i-1] - diff
+            fund[i-1] = fund[i-1] + diff
+            reinjection[i] = diff
+        risk_asset = max(min(multiplier * (fund[i-1] - floor[i-1]), fund[i-1]), Min_risk_part * fund[i-1])
+        fund[i] = risk_asset * (1 + risk_returns[i]) + (fund[i-1] - risk_asset) * (1 + safe_asset[i])
+        Goal = Goal - 1 / Rebalancement_frequency
+
+    return fund , floor , reinjection , reference , (fund[1:] - fund[:-1]) / fund[:-1]
+
+
+def _backends() :
+    backends = [pytest.param((TIPP_Model._tipp_loop, TIPP_Model._tipp_loop_constant_rate), id = 'python')]
+    if TIPP_Model.nb is not None :
+        backends.append(pytest.param((TIPP_Model._tipp_kernel, TIPP_Model._tipp_kernel_constant_rate), id = 'numba'))
+    try :
+        from pyinsurance.ts import _tipp
+        backends.append(pytest.param((_tipp.tipp_kernel, _tipp.tipp_kernel_constant_rate), id = 'cython'))
+    except ImportError :
+        backends.append(pytest.param(None, id = 'cython', marks = pytest.mark.skip('extension not built')))
+    return backends
+
+
+@pytest.fixture(params = _backends())
+def backend(request, monkeypatch) :
+    kernel , kernel_constant_rate = request.param
+    monkeypatch.setattr(TIPP_Model, '_run_kernel', kernel)
+    monkeypatch.setattr(TIPP_Model, '_run_kernel_constant_rate', kernel_constant_rate)
+
+
+def _random_case(constant_rate, volatility, Capital_reinjection_rate) :
+    rng = np.random.default_rng(0)
+    risk_returns = pd.Series(rng.normal(0.0005, volatility, 2000))
+    if constant_rate :
+        safe_asset = pd.Series(np.full(2000, 0.0002))
+    else :
+        safe_asset = pd.Series(np.abs(rng.normal(0.0002, 0.0001, 2000)))
+    return risk_returns , safe_asset , (0.05, 0.4, Capital_reinjection_rate, 100, 0.8, 10, 52)
+
+
+CASES = {
+    'varying_rate' : lambda : _random_case(False, 0.02, 0.8),
+    'constant_rate' : lambda : _random_case(True, 0.02, 0.8),
+    'reinjection_heavy' : lambda : _random_case(False, 0.05, 0.95),
+    'bundled_data' : lambda : (load_sp500().iloc[:, 0], load_irx().iloc[:, 0] / 52, (0.05, 0.4, 0.8, 100, 0.8, 10, 52)),
+}
+
+
+@pytest.mark.parametrize('case', list(CASES))
+def test_kernels_match_reference(backend, case) :
+    risk_returns , safe_asset , params = CASES[case]()
+    expected = reference_tipp(risk_returns.values, safe_asset.values, *params)
+    if case == 'reinjection_heavy' :
+        assert np.count_nonzero(expected[2]) > 100
+
+    result = TIPP(risk_returns, safe_asset, *params).tipp
+
+    for actual , wanted in zip(result[:4] + result[6:], expected) :
+        np.testing.assert_allclose(actual, wanted, rtol = 1e-9, atol = 1e-9)
+    np.testing.assert_array_equal(result[4], risk_returns.values[1:])
+    np.testing.assert_array_equal(result[5], safe_asset.values[1:])
+
+
+def test_batch_matches_single_runs() :
+    rng = np.random.default_rng(1)
+    risk_returns = rng.normal(0.0005, 0.03, (4, 800))
+    safe_asset = np.abs(rng.normal(0.0002, 0.0001, (4, 800)))
+    safe_asset[1] = 0.0003
+    params = (0.05, 0.4, 0.9, 100, 0.8, 10, 52)
+
+    batch = TIPP.tipp_batch(risk_returns, safe_asset, *params)
+
+    for s in range(risk_returns.shape[0]) :
+        single = TIPP(pd.Series(risk_returns[s]), pd.Series(safe_asset[s]), *params).tipp
+        for actual , wanted in zip(batch, single) :
+            np.testing.assert_allclose(actual[s], wanted, rtol = 1e-12, atol = 1e-12)